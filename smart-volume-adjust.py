@@ -4,26 +4,77 @@ otherwise sink volume will be changed
 
 volume
 """
-import re
-from argparse import ArgumentParser
-from sys import stderr
-from typing import Optional
 
-from pulsectl import Pulse, PulseSinkInputInfo
+from __future__ import annotations
+
+import fcntl
+import json
+import os
+import re
+import socket
+import threading
+from argparse import ArgumentParser, Namespace
+from sys import argv, stderr
+from typing import TYPE_CHECKING, Callable, Optional
+
+# pulsectl loads libpulse through ctypes, which dominates the startup time.
+# It is only imported where a connection is made, so handing arguments over
+# to a running daemon does not need to load it at all.
+if TYPE_CHECKING:
+    from pulsectl import Pulse, PulseSinkInputInfo
+
+
+def _runtime_path(suffix: str) -> str:
+    """Returns a path only used by the current user for files shared between calls"""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, f"smart-volume-adjust.{suffix}")
+    return f"/tmp/smart-volume-adjust-{os.getuid()}.{suffix}"
+
+
+DAEMON_SOCKET = _runtime_path("sock")
+LOCK_FILE = _runtime_path("lock")
+PENDING_FILE = _runtime_path("pending")
+# characters with a special meaning in regex patterns
+REGEX_METACHARACTERS = frozenset(".^$*+?{}[]\\|()")
+# parts of patterns that change their meaning once patterns are merged into one
+# alternation: references to numbered groups (backreferences and conditionals)
+# would point to the wrong group and global inline flags (e.g. "(?i)") would
+# apply to all patterns before Python 3.11
+UNMERGEABLE = re.compile(r"\\[1-9]|\(\?\(\d|\(\?[aiLmsux]+\)")
+
+# Notify module from gi.repository, imported and initialised on first notification
+_Notify = None
+# notification ids by notification id file, so a long running process
+# (e.g. the daemon) only needs to read each file once
+_notification_ids = {}
+
+
+def _ensure_notify():
+    """Import and initialise libnotify once, returns None if unavailable"""
+    global _Notify
+    if _Notify is None:
+        try:
+            import gi
+
+            gi.require_version("Gtk", "4.0")
+            gi.require_version("Notify", "0.7")
+            from gi.repository import Notify
+
+        except ModuleNotFoundError:
+            return None
+
+        Notify.init("smart-volume-adjust")
+        _Notify = Notify
+    return _Notify
 
 
 def notify(
     title: str, text: str, notification_id_file: str = None, verbose: int = 0
 ) -> None:
     """Use GTK to send notifications"""
-    try:
-        import gi
-
-        gi.require_version("Gtk", "4.0")
-        gi.require_version("Notify", "0.7")
-        from gi.repository import Notify
-
-    except ModuleNotFoundError:
+    Notify = _ensure_notify()
+    if Notify is None:
         print(
             "Sorry, something went wrong with the notification. "
             "Are you using Gtk 3.0?",
@@ -31,24 +82,23 @@ def notify(
         )
         return
 
-    Notify.init("smart-volume-adjust")
-
     if verbose:
         print("notification id file:", notification_id_file)
 
     # check if we have a know notification id
-    notification_id = None
-    try:
-        with open(notification_id_file, "r") as f:
-            try:
-                notification_id = int(f.readline())
-            except ValueError:
-                print(
-                    f"notification id file malformated: {notification_id_file}",
-                    file=stderr,
-                )
-    except FileNotFoundError:
-        pass
+    notification_id = _notification_ids.get(notification_id_file)
+    if notification_id is None and notification_id_file:
+        try:
+            with open(notification_id_file, "r") as f:
+                try:
+                    notification_id = int(f.readline())
+                except ValueError:
+                    print(
+                        f"notification id file malformated: {notification_id_file}",
+                        file=stderr,
+                    )
+        except FileNotFoundError:
+            pass
 
     if verbose:
         print("notification id:", notification_id)
@@ -58,51 +108,128 @@ def notify(
         n.set_property("id", notification_id)
     n.show()
 
+    if not notification_id_file:
+        return
     # save notification id to enable subsequent call to read it
     # and modify notification
     if not notification_id:
+        notification_id = n.get_property("id")
         with open(notification_id_file, "w") as f:
-            f.write(str(n.get_property("id")))
+            f.write(str(notification_id))
+    _notification_ids[notification_id_file] = notification_id
+
+
+def pattern_matcher(patterns: list) -> Callable[[str], Optional[int]]:
+    """
+    Returns a function giving the index of the first pattern matching a name
+
+    Patterns without regex metacharacters (e.g. "Spotify") only need to match
+    the start of a name, which is checked with str.startswith if all patterns
+    are like that. Otherwise all patterns are merged into one alternation so every
+    name is only matched once. The leftmost alternative wins, which keeps the
+    priority order of the patterns.
+    """
+    if not any(REGEX_METACHARACTERS.intersection(pattern) for pattern in patterns):
+
+        def match(name: str) -> Optional[int]:
+            for idx, pattern in enumerate(patterns):
+                if name.startswith(pattern):
+                    return idx
+            return None
+
+        return match
+
+    # compile each pattern on its own first, so invalid patterns are reported
+    # as such instead of possibly becoming valid once merged
+    regexes = [re.compile(pattern) for pattern in patterns]
+
+    def match_each(name: str) -> Optional[int]:
+        for idx, regex in enumerate(regexes):
+            if regex.match(name):
+                return idx
+        return None
+
+    if any(UNMERGEABLE.search(pattern) for pattern in patterns):
+        return match_each
+    try:
+        combined_regex = re.compile(
+            "|".join(f"(?P<p{idx}>{pattern})" for idx, pattern in enumerate(patterns))
+        )
+    except re.error:
+        # e.g. a named group of a pattern clashing with the ones added here
+        return match_each
+
+    def match(name: str) -> Optional[int]:
+        match_ = combined_regex.match(name)
+        if not match_:
+            return None
+        if match_.lastgroup is None:
+            # the match did not end in one of the added groups, don't guess
+            return match_each(name)
+        return int(match_.lastgroup[1:])
+
+    return match
+
+
+def client_names_of(pulse: Pulse) -> dict[int, str]:
+    """Returns names of all clients by client index with a single query"""
+    return {client.index: client.name for client in pulse.client_list()}
 
 
 def sink_inputs_filter(
-    pulse: Pulse,
+    sink_inputs: list[PulseSinkInputInfo],
+    client_names: dict[int, str],
     sink_inputs_patterns: list = None,
     verbose: int = 0,
+    early_exit: bool = False,
 ) -> list[PulseSinkInputInfo]:
     """
     Returns filtered list of sinks by list of regexes
 
-    The returned list is prioritised in the order of patterns matching sink inputs
+    The returned list is prioritised in the order of patterns matching sink inputs.
+    With early_exit only the sink input with the highest priority is returned.
     """
-    sink_inputs_filtered = []
-    sink_inputs = pulse.sink_input_list()
+    if not sink_inputs_patterns:
+        return []
+
+    match = pattern_matcher(sink_inputs_patterns)
+    # one list of matched sink inputs per pattern to keep the priority order
+    sink_inputs_matched = [[] for _ in sink_inputs_patterns]
+
+    for sink_input in sink_inputs:
+        client_name = client_names.get(sink_input.client)
+        if client_name is None:
+            # sink inputs without a client or whose client is already gone
+            if verbose:
+                print(f"sink_input skipped: {sink_input.name} (unknown client)")
+            continue
+        pattern_idx = match(client_name)
+        if pattern_idx is not None:
+            if early_exit and pattern_idx == 0:
+                # nothing can have a higher priority than the first pattern
+                return [sink_input]
+            sink_inputs_matched[pattern_idx].append(sink_input)
+            if verbose:
+                print(
+                    f'sink_input matched "{sink_inputs_patterns[pattern_idx]}": '
+                    f"{client_name}"
+                )
+        else:
+            if verbose:
+                print(f"sink_input skipped: {client_name}")
 
-    for sink_inputs_pattern in sink_inputs_patterns:
-        if verbose:
-            print(f'Pattern: "{sink_inputs_pattern}"')
-        # to only need one iteration over sink_inputs, we need to loop over a copy of the list
-        # and keep track of how many elements we have already removed to correct for in in pop()
-        removed_count = 0
-        for idx, sink_input in enumerate(sink_inputs[:]):
-            if re.match(sink_inputs_pattern, pulse.client_info(sink_input.client).name):
-                sink_inputs_filtered.append(sink_input)
-                sink_inputs.pop(idx - removed_count)
-                removed_count += 1
-                if verbose:
-                    print(
-                        f"  sink_input matched: {pulse.client_info(sink_input.client).name}"
-                    )
-            else:
-                if verbose:
-                    print(
-                        f"  sink_input skipped: {pulse.client_info(sink_input.client).name}"
-                    )
+    sink_inputs_filtered = [
+        sink_input
+        for sink_inputs_of_pattern in sink_inputs_matched
+        for sink_input in sink_inputs_of_pattern
+    ]
+    if early_exit:
+        return sink_inputs_filtered[:1]
 
     if verbose:
         print("filtered sink inputs:")
         for sink_input in sink_inputs_filtered:
-            print(f"  {pulse.client_info(sink_input.client).name}")
+            print(f"  {client_names[sink_input.client]}")
 
     return sink_inputs_filtered
 
@@ -110,6 +237,7 @@ def sink_inputs_filter(
 def sink_input_with_sound(
     pulse: Pulse,
     priority_sink_inputs: list,
+    sample_time: float = 0.09,
     verbose: int = 0,
 ) -> Optional[PulseSinkInputInfo]:
     """Return first sink from list with sound output >0"""
@@ -117,9 +245,10 @@ def sink_input_with_sound(
         # using corked here might be a mistake since it might mean
         # that the corked setting is enabled (which is shitty anyways)
         # debug: pacmd list-sink-inputs |grep -e state: -e index: -e client:
-        if not sink_input.corked:
-            # listen for .09 seconds to sink_input streaming to default sink
-            if pulse.get_peak_sample(None, 0.09, sink_input.index):
+        if not sink_input.corked and not sink_input.mute:
+            # muted sink inputs are skipped without the blocking peak sample
+            # listen for sample_time seconds to sink_input streaming to default sink
+            if pulse.get_peak_sample(None, sample_time, sink_input.index):
                 return sink_input
     return None
 
@@ -128,6 +257,7 @@ def change_volume(
     pulse: Pulse,
     volume_change: float,
     sink_input: PulseSinkInputInfo = None,
+    client_names: dict[int, str] = None,
     default_to_sink: bool = False,
     notify_: bool = False,
     notify_absolute: bool = False,
@@ -139,21 +269,28 @@ def change_volume(
         sink_input.volume.value_flat += volume_change
         if not dry:
             pulse.sink_input_volume_set(sink_input.index, sink_input.volume)
+        # the name is only needed for output, don't query it otherwise
+        if not verbose and not notify_:
+            return
+        if client_names:
+            client_name = client_names[sink_input.client]
+        else:
+            client_name = pulse.client_info(sink_input.client).name
         if verbose:
             print(
-                f"Changing Sink Input Volume for {pulse.client_info(sink_input.client).name} "
+                f"Changing Sink Input Volume for {client_name} "
                 f"by {volume_change:+.2f} to {sink_input.volume.value_flat:.0%}",
             )
         if notify_:
             notification_id_file = None
-            notification_text = (
-                f"{volume_change:+.2f} for {pulse.client_info(sink_input.client).name}"
-            )
+            notification_text = f"{volume_change:+.2f} for {client_name}"
             if notify_absolute:
                 notification_id_file = (
                     f"/tmp/smart-volume-adjust-sinkinput-{sink_input.index}"
                 )
-                notification_text = f"{sink_input.volume.value_flat:.0%} for {pulse.client_info(sink_input.client).name}"
+                notification_text = (
+                    f"{sink_input.volume.value_flat:.0%} for {client_name}"
+                )
 
             notify(
                 "Sink Input Volume",
@@ -163,7 +300,8 @@ def change_volume(
             )
 
     elif default_to_sink:
-        current_sink = pulse.get_sink_by_name(pulse.server_info().default_sink_name)
+        # PulseAudio resolves the special name itself, saving a server_info() query
+        current_sink = pulse.get_sink_by_name("@DEFAULT_SINK@")
         current_sink.volume.value_flat += volume_change
         if not dry:
             pulse.sink_volume_set(current_sink.index, current_sink.volume)
@@ -189,17 +327,26 @@ def change_volume(
             )
 
 
-def main(args) -> None:
-    pulse = Pulse()
+def adjust_volume(
+    pulse: Pulse,
+    sink_inputs: list[PulseSinkInputInfo],
+    client_names: dict[int, str],
+    args: Namespace,
+) -> None:
+    """Pick sink input (or sink) according to args and change its volume"""
     sink_inputs_filtered = sink_inputs_filter(
-        pulse,
+        sink_inputs,
+        client_names,
         args.input_sinks_patterns,
         args.verbose,
+        # only the first sink input is needed if they are not checked for sound
+        early_exit=not args.filter_active and not args.verbose,
     )
     if args.filter_active:
         sink_input_to_change = sink_input_with_sound(
             pulse,
             sink_inputs_filtered,
+            args.sample_time,
             args.verbose,
         )
     else:
@@ -211,6 +358,7 @@ def main(args) -> None:
         pulse,
         args.volume_change,
         sink_input_to_change,
+        client_names,
         args.default_to_sink,
         args.notify,
         args.notify_absolute,
@@ -219,13 +367,261 @@ def main(args) -> None:
     )
 
 
-if __name__ == "__main__":
+def _has_target(args: Namespace) -> bool:
+    """Whether args can pick any sink input or sink to change at all"""
+    return bool(args.input_sinks_patterns or args.default_to_sink)
+
+
+def main(args, pulse: Pulse = None) -> None:
+    if not _has_target(args):
+        # no sink input can match and the sink is not to be changed either,
+        # so there is no need to connect to PulseAudio at all
+        if args.verbose:
+            print("no patterns given and not defaulting to sink, nothing to do")
+        return
+    if pulse is None:
+        from pulsectl import Pulse
+
+        with Pulse() as pulse:
+            main(args, pulse)
+        return
+
+    sink_inputs = pulse.sink_input_list()
+    client_names = client_names_of(pulse)
+    adjust_volume(pulse, sink_inputs, client_names, args)
+
+
+def _try_lock(lock_file) -> bool:
+    """Try to get an exclusive lock on an open file without blocking"""
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def queue_pending(arguments: list[str]) -> None:
+    """Append arguments of an invocation for the lock holder to handle"""
+    with open(PENDING_FILE, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(json.dumps(arguments) + "\n")
+
+
+def take_pending() -> list[list[str]]:
+    """Return and remove arguments of all queued invocations"""
+    try:
+        with open(PENDING_FILE, "r+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            lines = f.readlines()
+            f.truncate(0)
+    except FileNotFoundError:
+        return []
+    return [json.loads(line) for line in lines]
+
+
+def _without_volume_change(args: Namespace) -> dict:
+    return {key: value for key, value in vars(args).items() if key != "volume_change"}
+
+
+def coalesce(pending: list[list[str]]) -> list[Namespace]:
+    """Parse queued arguments and sum up volume changes of consecutive equal ones"""
+    coalesced = []
+    for arguments in pending:
+        args = parse_args(arguments)
+        unchanged = _without_volume_change(args)
+        if coalesced and unchanged == _without_volume_change(coalesced[-1]):
+            coalesced[-1].volume_change += args.volume_change
+        else:
+            coalesced.append(args)
+    return coalesced
+
+
+def main_coalesced(args: Namespace, arguments: list[str]) -> None:
+    """
+    Run main() while holding a lock, otherwise queue arguments for the lock holder
+
+    Invocations arriving while the volume is being changed (e.g. from a volume wheel)
+    are summed up and applied together once the current change is done.
+    """
+    with open(LOCK_FILE, "a") as lock_file:
+        if _try_lock(lock_file):
+            todo = [args]
+        else:
+            queue_pending(arguments)
+            # the lock holder might have finished before seeing our arguments
+            if not _try_lock(lock_file):
+                return
+            todo = []
+
+        # one connection for all changes handled while holding the lock
+        pulse = None
+        try:
+            while True:
+                if pulse is None and any(_has_target(args_) for args_ in todo):
+                    from pulsectl import Pulse
+
+                    pulse = Pulse()
+                for args_ in todo:
+                    main(args_, pulse)
+                todo = coalesce(take_pending())
+                if todo:
+                    continue
+
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                # arguments queued right before unlocking would be left behind
+                try:
+                    if not os.path.getsize(PENDING_FILE):
+                        return
+                except FileNotFoundError:
+                    return
+                if not _try_lock(lock_file):
+                    return
+                todo = coalesce(take_pending())
+        except BaseException:
+            # don't leave queued changes to be applied by some unrelated later call
+            take_pending()
+            raise
+        finally:
+            if pulse is not None:
+                pulse.close()
+
+
+def send_to_daemon(arguments: list[str]) -> bool:
+    """Hand arguments over to a running daemon, returns False if there is none"""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(DAEMON_SOCKET)
+            client.sendall(json.dumps(arguments).encode())
+    except OSError:
+        return False
+    return True
+
+
+def daemon() -> None:
+    """
+    Keep a PulseAudio connection and cached sink inputs to handle volume changes
+
+    Sink inputs and client names are only queried again after PulseAudio reported
+    a change for them. Other invocations of the script hand over their arguments
+    through a unix socket instead of connecting to PulseAudio themselves.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        already_running = probe.connect_ex(DAEMON_SOCKET) == 0
+    if already_running:
+        print(f"daemon is already listening on {DAEMON_SOCKET}", file=stderr)
+        exit(1)
+
+    from pulsectl import Pulse, PulseDisconnected, PulseIndexError
+
+    # (facility, index) -> latest event type, filled by the event listener thread
+    changes = {}
+    changes_lock = threading.Lock()
+
+    def on_event(event) -> None:
+        with changes_lock:
+            changes[(event.facility, event.index)] = event.t
+
+    # event_listen() blocks and the callback must not query PulseAudio,
+    # so events are received on a separate connection in a separate thread
+    pulse_events = Pulse("smart-volume-adjust-daemon-events")
+    pulse_events.event_mask_set("sink_input", "client")
+    pulse_events.event_callback_set(on_event)
+    events_thread = threading.Thread(target=pulse_events.event_listen, daemon=True)
+    events_thread.start()
+
+    pulse = Pulse("smart-volume-adjust-daemon")
+    sink_inputs = {}
+    client_names = {}
+
+    def load() -> None:
+        sink_inputs.clear()
+        sink_inputs.update(
+            (sink_input.index, sink_input) for sink_input in pulse.sink_input_list()
+        )
+        client_names.clear()
+        client_names.update(client_names_of(pulse))
+
+    def apply_changes() -> None:
+        with changes_lock:
+            pending = dict(changes)
+            changes.clear()
+        for (facility, index), event_type in pending.items():
+            cache = sink_inputs if facility == "sink_input" else client_names
+            if event_type == "remove":
+                cache.pop(index, None)
+                continue
+            try:
+                if facility == "sink_input":
+                    sink_inputs[index] = pulse.sink_input_info(index)
+                else:
+                    client_names[index] = pulse.client_info(index).name
+            except PulseIndexError:
+                # already gone again, the remove event will follow
+                cache.pop(index, None)
+
+    load()
+
+    try:
+        os.unlink(DAEMON_SOCKET)
+    except FileNotFoundError:
+        pass
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        # only allow the current user to send commands
+        umask = os.umask(0o177)
+        server.bind(DAEMON_SOCKET)
+        os.umask(umask)
+        server.listen()
+        try:
+            while True:
+                connection, _ = server.accept()
+                # don't let a client that never closes block all other commands
+                connection.settimeout(1)
+                with connection:
+                    data = b""
+                    try:
+                        while chunk := connection.recv(4096):
+                            data += chunk
+                    except socket.timeout:
+                        print("timed out waiting for command", file=stderr)
+                        continue
+                if not data:
+                    continue
+
+                if not events_thread.is_alive():
+                    # cache can not be trusted anymore, hand over and stop
+                    main(parse_args(json.loads(data)))
+                    break
+
+                try:
+                    args = parse_args(json.loads(data))
+                    apply_changes()
+                    adjust_volume(
+                        pulse,
+                        [sink_inputs[index] for index in sorted(sink_inputs)],
+                        client_names,
+                        args,
+                    )
+                    if args.dry_run:
+                        # volumes of cached sink inputs were changed in place
+                        load()
+                except PulseDisconnected:
+                    raise
+                except (Exception, SystemExit) as e:
+                    print(f"failed to handle {data!r}: {e!r}", file=stderr)
+        finally:
+            os.unlink(DAEMON_SOCKET)
+
+
+def parse_args(arguments: list[str] = None) -> Namespace:
     parser = ArgumentParser(
         description="Change volume of active PulseAudio sink input by given volume.",
     )
 
     parser.add_argument(
         "volume_change",
+        nargs="?",
+        type=float,
         help=(
             "Amount of Volume to change as a float. "
             "Example: -0.05 for lowering volume by 5%"
@@ -252,6 +648,15 @@ if __name__ == "__main__":
         default=False,
         help="Only consider sink inputs that have been active",
     )
+    parser.add_argument(
+        "--sample-time",
+        type=float,
+        default=0.09,
+        help=(
+            "Seconds to listen to each sink input for --filter-active. "
+            "Increase if playing sink inputs are not detected (default: 0.09)"
+        ),
+    )
     parser.add_argument(
         "--dry-run",
         action="store_true",
@@ -275,13 +680,28 @@ if __name__ == "__main__":
         default=False,
         help="Show absolute volume instead of volume change",
     )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        default=False,
+        help=(
+            "Keep running and handle volume changes of other invocations "
+            f"through {DAEMON_SOCKET}. Output of --verbose is shown by the daemon"
+        ),
+    )
 
-    args = parser.parse_args()
+    args = parser.parse_args(arguments)
+    if args.daemon:
+        return args
+    if args.volume_change is None:
+        parser.error("the following arguments are required: volume_change")
+
+    return args
 
-    try:
-        args.volume_change = float(args.volume_change)
-    except ValueError:
-        print("volume_change needs to be a number between -1 and 1")
-        exit(1)
 
-    main(args)
+if __name__ == "__main__":
+    args = parse_args()
+    if args.daemon:
+        daemon()
+    elif not send_to_daemon(argv[1:]):
+        main_coalesced(args, argv[1:])